@@ -3,22 +3,124 @@ BlackRoad Event Sourcing - CQRS framework with projections and snapshots
 """
 from __future__ import annotations
 import json
-import uuid
+import time
+import secrets
 import sqlite3
 import logging
-from dataclasses import dataclass, field, asdict
-from typing import Any, Callable, Dict, List, Optional, Type
+import threading
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import partial
+from dataclasses import dataclass, field, fields
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Type
 from datetime import datetime
-from copy import deepcopy
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - optional speedup
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+HAS_ORJSON = orjson is not None
+
+if HAS_ORJSON:
+    # With the optional orjson extra, NaN/Infinity are stored as null and
+    # integers wider than 64 bits are rejected.  Other types stdlib json cannot
+    # encode (datetime, dataclasses) are rejected too, via _reject.
+    _ORJSON_OPTS = (
+        orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+    )
+
+    def _reject(obj: Any) -> Any:
+        raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+    def _dumps(obj: Any) -> str:
+        return orjson.dumps(obj, default=_reject, option=_ORJSON_OPTS).decode()
+
+    def _loads(data: Any) -> Any:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # NaN/Infinity literals written by stdlib json without the extra.
+            return json.loads(data)
+else:
+    _dumps = json.dumps
+    _loads = json.loads
+
+
+def _new_id() -> str:
+    """Return a 32-char hex id: 48-bit millisecond clock + 80 random bits.
+
+    The time prefix keeps ids roughly insert-ordered, so the UNIQUE index on
+    ``events.id`` grows at its right edge instead of splitting random pages.
+    """
+    return f"{time.time_ns() // 1_000_000:012x}{secrets.token_hex(10)}"
+
+
+# SQLite 3.45 added JSONB, a pre-parsed binary JSON encoding.  Stores opt in
+# with EventStore(jsonb=True); the choice is recorded in the database.
+HAS_JSONB = sqlite3.sqlite_version_info >= (3, 45, 0)
+
+
+def _event_statements(jsonb: bool) -> Dict[str, str]:
+    """Event SQL that reads or writes the payload and metadata columns."""
+    json_in = "jsonb(?)" if jsonb else "?"
+    payload = "json(payload)" if jsonb else "payload"
+    metadata = "json(metadata)" if jsonb else "metadata"
+    columns = (
+        "id, aggregate_id, aggregate_type, event_type, "
+        f"{payload}, version, timestamp, caused_by, {metadata}"
+    )
+    return {
+        "_SQL_APPEND": (
+            "INSERT INTO events (id, aggregate_id, aggregate_type, event_type, payload, "
+            "version, timestamp, caused_by, metadata) "
+            f"VALUES (?,?,?,?,{json_in},?,?,?,{json_in})"
+        ),
+        "_SQL_LOAD": (
+            f"SELECT {columns} FROM events "
+            "WHERE aggregate_id=? AND version>? ORDER BY version ASC"
+        ),
+        "_SQL_LOAD_PAYLOADS": (
+            f"SELECT version, {payload} FROM events "
+            "WHERE aggregate_id=? AND version>? ORDER BY version ASC"
+        ),
+        "_SQL_LOAD_ALL": (
+            f"SELECT {columns} FROM events "
+            "WHERE aggregate_type=? AND position>? ORDER BY position ASC"
+        ),
+        "_SQL_LOAD_ALL_EVENTS": (
+            f"SELECT {columns}, position FROM events WHERE position>? ORDER BY position ASC"
+        ),
+        "_SQL_PROJECTION_ROWS": (
+            f"SELECT event_type, aggregate_id, {payload}, position FROM events "
+            "WHERE position>? ORDER BY position ASC"
+        ),
+    }
+
+
+_TEXT_STATEMENTS = _event_statements(jsonb=False)
+_JSONB_STATEMENTS = _event_statements(jsonb=True)
+
+# Connection PRAGMAs applied by EventStore unless overridden.  WAL plus
+# synchronous=NORMAL moves fsyncs from every commit to checkpoint time.
+DEFAULT_PRAGMAS: Dict[str, Any] = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "temp_store": "MEMORY",
+    "cache_size": -65536,
+    "mmap_size": 268435456,
+    "busy_timeout": 5000,
+}
+
 
 # ---------------------------------------------------------------------------
 # Domain objects
 # ---------------------------------------------------------------------------
 
-@dataclass
+@dataclass(slots=True)
 class Event:
     id: str
     aggregate_id: str
@@ -39,35 +141,31 @@ class Event:
         payload: Dict,
         version: int,
         caused_by: Optional[str] = None,
+        *,
+        at: Optional[str] = None,
         **metadata,
     ) -> "Event":
         return cls(
-            id=str(uuid.uuid4()),
+            id=_new_id(),
             aggregate_id=aggregate_id,
             aggregate_type=aggregate_type,
             event_type=event_type,
             payload=payload,
             version=version,
-            timestamp=datetime.utcnow().isoformat(),
+            timestamp=at or datetime.utcnow().isoformat(),
             caused_by=caused_by,
             metadata=metadata,
         )
 
     def to_dict(self) -> Dict:
-        return {
-            "id": self.id,
-            "aggregate_id": self.aggregate_id,
-            "aggregate_type": self.aggregate_type,
-            "event_type": self.event_type,
-            "payload": self.payload,
-            "version": self.version,
-            "timestamp": self.timestamp,
-            "caused_by": self.caused_by,
-            "metadata": self.metadata,
-        }
+        return {name: getattr(self, name) for name in EVENT_FIELDS}
+
 
+# Event field names in declaration order; also the column order of event rows.
+EVENT_FIELDS: Tuple[str, ...] = tuple(f.name for f in fields(Event))
 
-@dataclass
+
+@dataclass(slots=True)
 class Aggregate:
     id: str
     type: str
@@ -84,6 +182,8 @@ class Aggregate:
         event_type: str,
         payload: Dict,
         caused_by: Optional[str] = None,
+        *,
+        at: Optional[str] = None,
     ) -> Event:
         self.version += 1
         evt = Event.create(
@@ -93,31 +193,68 @@ class Aggregate:
             payload=payload,
             version=self.version,
             caused_by=caused_by,
+            at=at,
         )
         self.apply(evt)
         return evt
 
+    def raise_events(
+        self,
+        changes: List[Tuple[str, Dict]],
+        caused_by: Optional[str] = None,
+    ) -> List[Event]:
+        """Raise several ``(event_type, payload)`` events sharing one timestamp."""
+        at = datetime.utcnow().isoformat()
+        return [
+            self.raise_event(event_type, payload, caused_by=caused_by, at=at)
+            for event_type, payload in changes
+        ]
+
 
-@dataclass
+@dataclass(slots=True)
 class Projection:
+    """Read-model built from the event stream.
+
+    ``handlers`` take ``(state, event)``.  ``row_handlers`` take
+    ``(state, event_type, aggregate_id, payload)`` and let replay skip
+    building Event objects when a projection uses only them.
+    """
+
     name: str
     handlers: Dict[str, Callable] = field(default_factory=dict)
     last_position: int = 0
     state: Dict[str, Any] = field(default_factory=dict)
+    row_handlers: Dict[str, Callable] = field(default_factory=dict)
 
     def handle(self, event: Event) -> bool:
+        handled = False
         handler = self.handlers.get(event.event_type)
         if handler:
-            try:
-                handler(self.state, event)
-                return True
-            except Exception as exc:
-                logger.error("Projection %s handler error: %s", self.name, exc)
-                return False
+            handled = self._call(handler, self.state, event)
+        row_handler = self.row_handlers.get(event.event_type)
+        if row_handler:
+            handled = self._call(
+                row_handler, self.state, event.event_type, event.aggregate_id, event.payload
+            ) or handled
+        return handled
+
+    def handle_row(self, event_type: str, aggregate_id: str, payload: str) -> bool:
+        """Apply a row handler; the raw JSON payload is decoded only on a match."""
+        handler = self.row_handlers.get(event_type)
+        if handler:
+            return self._call(handler, self.state, event_type, aggregate_id, _loads(payload))
         return False
 
+    def _call(self, handler: Callable, *args) -> bool:
+        try:
+            handler(*args)
+            return True
+        except Exception as exc:
+            logger.error("Projection %s handler error: %s", self.name, exc)
+            return False
+
 
-@dataclass
+@dataclass(slots=True)
 class Snapshot:
     aggregate_id: str
     version: int
@@ -133,11 +270,11 @@ class Snapshot:
         }
 
 
-@dataclass
+@dataclass(slots=True)
 class Command:
     type: str
     payload: Dict[str, Any]
-    id: str = field(default_factory=lambda: str(uuid.uuid4()))
+    id: str = field(default_factory=_new_id)
     issued_at: str = field(default_factory=lambda: datetime.utcnow().isoformat())
     issued_by: Optional[str] = None
 
@@ -146,30 +283,185 @@ class Command:
 # Event Store (SQLite, append-only)
 # ---------------------------------------------------------------------------
 
-class EventStore:
-    """Append-only SQLite event store."""
+class _ReadConnection:
+    """Holder for one thread's read connection.
 
-    def __init__(self, db_path: str = ":memory:"):
-        self.conn = sqlite3.connect(db_path, check_same_thread=False)
-        self._init_db()
-        self._position_counter = 0
+    Only the thread-local slot references it, so the connection is closed
+    as soon as its thread exits.
+    """
 
-    def _init_db(self):
-        self.conn.executescript("""
+    __slots__ = ("conn", "close", "__weakref__")
+
+    def __init__(self, conn: sqlite3.Connection):
+        self.conn = conn
+        self.close = weakref.finalize(self, conn.close)
+
+
+class EventStore:
+    """Append-only SQLite event store.
+
+    Writes go through a single connection serialized by ``transaction()``.
+    For file databases each reading thread gets its own ``query_only``
+    connection, so with WAL readers run alongside the writer.
+    """
+
+    # TEXT storage; stores opened with jsonb=True override these per instance.
+    _SQL_APPEND = _TEXT_STATEMENTS["_SQL_APPEND"]
+    _SQL_LAST_ROWID = "SELECT last_insert_rowid()"
+    _SQL_LOAD = _TEXT_STATEMENTS["_SQL_LOAD"]
+    _SQL_LOAD_PAYLOADS = _TEXT_STATEMENTS["_SQL_LOAD_PAYLOADS"]
+    _SQL_LOAD_ALL = _TEXT_STATEMENTS["_SQL_LOAD_ALL"]
+    _SQL_LOAD_ALL_EVENTS = _TEXT_STATEMENTS["_SQL_LOAD_ALL_EVENTS"]
+    _SQL_PROJECTION_ROWS = _TEXT_STATEMENTS["_SQL_PROJECTION_ROWS"]
+    # events is append-only, so the AUTOINCREMENT counter equals MAX(position).
+    _SQL_POSITION = "SELECT seq FROM sqlite_sequence WHERE name='events'"
+    _SQL_SAVE_SNAPSHOT = (
+        "INSERT OR REPLACE INTO snapshots (aggregate_id, version, state, created_at) VALUES (?,?,?,?)"
+    )
+    _SQL_LOAD_SNAPSHOT = (
+        "SELECT aggregate_id, version, state, created_at FROM snapshots WHERE aggregate_id=?"
+    )
+    _SQL_COUNT_BY_TYPE = "SELECT event_type, COUNT(*) FROM events GROUP BY event_type"
+    _SQL_LOAD_META = "SELECT value FROM store_meta WHERE key=?"
+    _SQL_SAVE_META = "INSERT INTO store_meta (key, value) VALUES (?,?)"
+
+    def __init__(
+        self,
+        db_path: str = ":memory:",
+        pragmas: Optional[Dict[str, Any]] = None,
+        snapshot_every: int = 0,
+        cache_size: int = 128,
+        jsonb: Optional[bool] = None,
+    ):
+        self.db_path = db_path
+        self.snapshot_every = snapshot_every
+        self.cache_size = cache_size
+        self._custom_apply_types: set = set()
+        self._aggregate_cache: "OrderedDict[Tuple[str, str], Tuple[int, str]]" = OrderedDict()
+        self._cache_lock = threading.Lock()
+        self._cache_generation = 0
+        self._write_lock = threading.RLock()
+        self._tx_owner: Optional[int] = None
+        self._local = threading.local()
+        self._read_conns: "weakref.WeakSet[_ReadConnection]" = weakref.WeakSet()
+        # ":memory:" and "" (a private temp file) are visible to one connection only.
+        self._private = db_path in (":memory:", "")
+        self.pragmas = dict(DEFAULT_PRAGMAS)
+        if self._private:
+            # Private databases cannot use WAL and gain nothing from mmap.
+            self.pragmas.pop("journal_mode")
+            self.pragmas.pop("mmap_size")
+        if pragmas:
+            self.pragmas.update(pragmas)
+        self._write_conn = self._connect()
+        self.jsonb = self._init_db(jsonb)
+        if self.jsonb:
+            vars(self).update(_JSONB_STATEMENTS)
+            # jsonb() would quietly turn NaN/Infinity into null.
+            self._dump_json = _dumps if HAS_ORJSON else partial(json.dumps, allow_nan=False)
+        else:
+            self._dump_json = _dumps
+        self._position_counter = self._read_position(self.conn)
+
+    @property
+    def conn(self) -> sqlite3.Connection:
+        """The shared write connection."""
+        return self._write_conn
+
+    @property
+    def read_conn(self) -> sqlite3.Connection:
+        """A connection for reads on the calling thread.
+
+        Inside this thread's transaction, and for private (in-memory or
+        temporary) databases, this is the write connection so uncommitted
+        writes stay visible.
+        """
+        if self._private or self._tx_owner == threading.get_ident():
+            return self._write_conn
+        reader = getattr(self._local, "reader", None)
+        if reader is None:
+            conn = self._connect()
+            conn.execute("PRAGMA query_only=1")
+            reader = _ReadConnection(conn)
+            self._local.reader = reader
+            with self._cache_lock:
+                self._read_conns.add(reader)
+        return reader.conn
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=256)
+        for name, value in self.pragmas.items():
+            if value is not None:
+                conn.execute(f"PRAGMA {name}={value}")
+        return conn
+
+    def close(self):
+        """Close the write connection and every live per-thread read connection."""
+        with self._cache_lock:
+            readers = list(self._read_conns)
+        for reader in readers:
+            reader.close()
+        self._write_conn.close()
+
+    def _init_db(self, jsonb: Optional[bool]) -> bool:
+        """Create the schema and return whether payloads are stored as JSONB.
+
+        The payload format is fixed when the database is created and recorded
+        in ``store_meta``; ``jsonb=None`` accepts whatever is recorded.
+        """
+        conn = self.conn
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS store_meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)"
+        )
+        row = conn.execute(self._SQL_LOAD_META, ("payload_format",)).fetchone()
+        if row is not None:
+            stored = row[0]
+        else:
+            # Databases created before the marker existed: sniff a stored payload.
+            has_events = conn.execute(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='events'"
+            ).fetchone()
+            if has_events:
+                sample = conn.execute("SELECT typeof(payload) FROM events LIMIT 1").fetchone()
+                stored = "jsonb" if sample and sample[0] == "blob" else "text"
+            else:
+                stored = "jsonb" if jsonb else "text"
+            conn.execute(self._SQL_SAVE_META, ("payload_format", stored))
+        if jsonb is not None and jsonb != (stored == "jsonb"):
+            conn.rollback()
+            raise ValueError(f"{self.db_path!r} stores payloads as {stored}")
+        if stored == "jsonb" and not HAS_JSONB:
+            conn.rollback()
+            raise sqlite3.NotSupportedError(
+                f"{self.db_path!r} stores JSONB payloads, which need SQLite 3.45+ "
+                f"(this is {sqlite3.sqlite_version})"
+            )
+        json_type = "BLOB" if stored == "jsonb" else "TEXT"
+        conn.executescript(f"""
             CREATE TABLE IF NOT EXISTS events (
                 position     INTEGER PRIMARY KEY AUTOINCREMENT,
                 id           TEXT UNIQUE NOT NULL,
                 aggregate_id TEXT NOT NULL,
                 aggregate_type TEXT NOT NULL,
                 event_type   TEXT NOT NULL,
-                payload      TEXT NOT NULL,
+                payload      {json_type} NOT NULL,
                 version      INTEGER NOT NULL,
                 timestamp    TEXT NOT NULL,
                 caused_by    TEXT,
-                metadata     TEXT
+                metadata     {json_type}
             );
-            CREATE INDEX IF NOT EXISTS idx_aggregate ON events(aggregate_id, version);
+            -- Covering index: per-aggregate loads are served from the index
+            -- alone, without a second lookup into the table by rowid.
+            DROP INDEX IF EXISTS idx_aggregate;
+            CREATE INDEX IF NOT EXISTS idx_agg_cover ON events(
+                aggregate_id, version, id, aggregate_type, event_type,
+                payload, timestamp, caused_by, metadata
+            );
+            -- position is the rowid, which every index entry already ends
+            -- with, so idx_type returns a type's events in position order.
+            DROP INDEX IF EXISTS idx_type_pos;
             CREATE INDEX IF NOT EXISTS idx_type ON events(aggregate_type);
+            CREATE INDEX IF NOT EXISTS idx_event_type ON events(event_type);
 
             CREATE TABLE IF NOT EXISTS snapshots (
                 aggregate_id TEXT PRIMARY KEY,
@@ -181,7 +473,7 @@ class EventStore:
             CREATE TABLE IF NOT EXISTS projections (
                 name          TEXT PRIMARY KEY,
                 last_position INTEGER NOT NULL DEFAULT 0,
-                state         TEXT NOT NULL DEFAULT '{}'
+                state         TEXT NOT NULL DEFAULT '{{}}'
             );
 
             CREATE TABLE IF NOT EXISTS command_log (
@@ -193,7 +485,32 @@ class EventStore:
                 handled_at TEXT
             );
         """)
-        self.conn.commit()
+        conn.commit()
+        return stored == "jsonb"
+
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """Group writes into one atomic commit; nested calls join the outer one."""
+        if self._tx_owner == threading.get_ident():
+            yield self.conn
+            return
+        with self._write_lock:
+            self._tx_owner = threading.get_ident()
+            try:
+                yield self.conn
+            except BaseException:
+                self.conn.rollback()
+                # Undone appends release their positions, and cached aggregates
+                # may have folded the undone events.
+                self._position_counter = self._read_position(self.conn)
+                with self._cache_lock:
+                    self._aggregate_cache.clear()
+                    self._cache_generation += 1
+                raise
+            else:
+                self.conn.commit()
+            finally:
+                self._tx_owner = None
 
     # ------------------------------------------------------------------
     # Core append/load
@@ -201,110 +518,147 @@ class EventStore:
 
     def append(self, aggregate_id: str, events: List[Event]) -> List[int]:
         """Append events for an aggregate and return their positions."""
-        positions = []
-        for evt in events:
-            cur = self.conn.execute(
-                """INSERT INTO events
-                   (id, aggregate_id, aggregate_type, event_type, payload,
-                    version, timestamp, caused_by, metadata)
-                   VALUES (?,?,?,?,?,?,?,?,?)""",
-                (
-                    evt.id,
-                    evt.aggregate_id,
-                    evt.aggregate_type,
-                    evt.event_type,
-                    json.dumps(evt.payload),
-                    evt.version,
-                    evt.timestamp,
-                    evt.caused_by,
-                    json.dumps(evt.metadata),
-                ),
+        if not events:
+            return []
+        dump_json = self._dump_json
+        rows = [
+            (
+                evt.id,
+                evt.aggregate_id,
+                evt.aggregate_type,
+                evt.event_type,
+                dump_json(evt.payload),
+                evt.version,
+                evt.timestamp,
+                evt.caused_by,
+                dump_json(evt.metadata),
             )
-            positions.append(cur.lastrowid)
-        self.conn.commit()
+            for evt in events
+        ]
+        with self.transaction():
+            self.conn.executemany(self._SQL_APPEND, rows)
+            # AUTOINCREMENT hands out contiguous positions within one statement
+            # batch on a single connection, so the last rowid bounds the range.
+            last = self.conn.execute(self._SQL_LAST_ROWID).fetchone()[0]
+            self._position_counter = last
+            # Snapshot in the same transaction, so a failure leaves no events
+            # behind; reconstruct never reads snapshots of custom-apply types.
+            if (
+                self.snapshot_every
+                and events[0].aggregate_type not in self._custom_apply_types
+                and any(evt.version % self.snapshot_every == 0 for evt in events)
+            ):
+                self.create_snapshot(aggregate_id)
+        positions = list(range(last - len(events) + 1, last + 1))
         logger.debug("Appended %d events for aggregate %s", len(events), aggregate_id)
         return positions
 
     def load(self, aggregate_id: str, from_version: int = 0) -> List[Event]:
         """Load all events for an aggregate from a given version."""
-        rows = self.conn.execute(
-            "SELECT id, aggregate_id, aggregate_type, event_type, payload, version, timestamp, caused_by, metadata "
-            "FROM events WHERE aggregate_id=? AND version>? ORDER BY version ASC",
+        rows = self.read_conn.execute(
+            self._SQL_LOAD,
             (aggregate_id, from_version),
         ).fetchall()
         return [self._row_to_event(r) for r in rows]
 
     def load_all(self, aggregate_type: str, after_position: int = 0) -> List[Event]:
         """Load all events of a given aggregate type after a position."""
-        rows = self.conn.execute(
-            "SELECT id, aggregate_id, aggregate_type, event_type, payload, version, timestamp, caused_by, metadata "
-            "FROM events WHERE aggregate_type=? AND position>? ORDER BY position ASC",
+        rows = self.read_conn.execute(
+            self._SQL_LOAD_ALL,
             (aggregate_type, after_position),
         ).fetchall()
         return [self._row_to_event(r) for r in rows]
 
     def load_all_events(self, after_position: int = 0) -> List[Event]:
         """Load all events in the store after a position."""
-        rows = self.conn.execute(
-            "SELECT id, aggregate_id, aggregate_type, event_type, payload, version, timestamp, caused_by, metadata "
-            "FROM events WHERE position>? ORDER BY position ASC",
-            (after_position,),
-        ).fetchall()
-        return [self._row_to_event(r) for r in rows]
+        return list(self.iter_all_events(after_position))
+
+    def iter_all_events(self, after_position: int = 0) -> Iterator[Event]:
+        """Lazily yield all events in the store after a position, in order."""
+        for _, evt in self.iter_positioned(after_position):
+            yield evt
+
+    def iter_positioned(self, after_position: int = 0) -> Iterator[Tuple[int, Event]]:
+        """Like iter_all_events, but yield ``(position, event)`` pairs."""
+        for row in self.read_conn.execute(self._SQL_LOAD_ALL_EVENTS, (after_position,)):
+            yield row[9], self._row_to_event(row)
+
+    def iter_projection_rows(self, after_position: int = 0) -> Iterator[Tuple[str, str, str, int]]:
+        """Yield ``(event_type, aggregate_id, payload_json, position)`` rows after a position."""
+        return iter(self.read_conn.execute(self._SQL_PROJECTION_ROWS, (after_position,)))
 
     def get_position(self) -> int:
-        """Return the latest global event position."""
-        row = self.conn.execute("SELECT MAX(position) FROM events").fetchone()
-        return row[0] or 0
+        """Return the latest global event position.
+
+        Served from memory: the counter is loaded on open and advanced by
+        ``append``, so writes from other processes are not reflected.
+        """
+        return self._position_counter
+
+    def stored_position(self) -> int:
+        """Read the latest position from the database, including other writers' appends."""
+        return self._read_position(self.read_conn)
+
+    def _read_position(self, conn: sqlite3.Connection) -> int:
+        row = conn.execute(self._SQL_POSITION).fetchone()
+        return row[0] if row else 0
+
+    def load_dicts(self, aggregate_id: str, from_version: int = 0) -> List[Dict]:
+        """Load an aggregate's events as plain dicts, without building Event objects."""
+        rows = self.read_conn.execute(self._SQL_LOAD, (aggregate_id, from_version))
+        return [self._row_to_dict(r) for r in rows]
+
+    @staticmethod
+    def _decode_row(row) -> Tuple:
+        """Decode an event row's JSON columns; values stay in EVENT_FIELDS order."""
+        return (*row[:4], _loads(row[4]), *row[5:8], _loads(row[8]) if row[8] else {})
+
+    def _row_to_dict(self, row) -> Dict:
+        return dict(zip(EVENT_FIELDS, self._decode_row(row)))
 
     def _row_to_event(self, row) -> Event:
-        return Event(
-            id=row[0],
-            aggregate_id=row[1],
-            aggregate_type=row[2],
-            event_type=row[3],
-            payload=json.loads(row[4]),
-            version=row[5],
-            timestamp=row[6],
-            caused_by=row[7],
-            metadata=json.loads(row[8]) if row[8] else {},
-        )
+        return Event(*self._decode_row(row))
+
+    def analyze(self):
+        """Refresh planner statistics; run after bulk loads."""
+        with self.transaction():
+            self.conn.execute("ANALYZE")
 
     # ------------------------------------------------------------------
     # Snapshots
     # ------------------------------------------------------------------
 
     def create_snapshot(self, aggregate_id: str) -> Optional[Snapshot]:
-        """Create a snapshot for an aggregate from current events."""
-        events = self.load(aggregate_id)
-        if not events:
-            return None
-        state: Dict = {}
-        version = 0
-        for evt in events:
-            state.update(evt.payload)
-            version = evt.version
+        """Create a snapshot for an aggregate, folding only events since the last one."""
+        prev = self.load_snapshot(aggregate_id)
+        # load_snapshot decodes a fresh dict, so it can be folded into in place.
+        state: Dict = prev.state if prev else {}
+        version = prev.version if prev else 0
+        start = version
+        for version, payload in self.read_conn.execute(
+            self._SQL_LOAD_PAYLOADS, (aggregate_id, version)
+        ):
+            state.update(_loads(payload))
+        if version == start:
+            return prev
         snap = Snapshot(aggregate_id=aggregate_id, version=version, state=state)
-        self.conn.execute(
-            "INSERT OR REPLACE INTO snapshots (aggregate_id, version, state, created_at) VALUES (?,?,?,?)",
-            (snap.aggregate_id, snap.version, json.dumps(snap.state), snap.created_at),
-        )
-        self.conn.commit()
+        with self.transaction():
+            self.conn.execute(
+                self._SQL_SAVE_SNAPSHOT,
+                (snap.aggregate_id, snap.version, _dumps(snap.state), snap.created_at),
+            )
         logger.info("Created snapshot for %s at version %d", aggregate_id, version)
         return snap
 
     def load_snapshot(self, aggregate_id: str) -> Optional[Snapshot]:
         """Load the latest snapshot for an aggregate."""
-        row = self.conn.execute(
-            "SELECT aggregate_id, version, state, created_at FROM snapshots WHERE aggregate_id=?",
-            (aggregate_id,),
-        ).fetchone()
+        row = self.read_conn.execute(self._SQL_LOAD_SNAPSHOT, (aggregate_id,)).fetchone()
         if not row:
             return None
         return Snapshot(
             aggregate_id=row[0],
             version=row[1],
-            state=json.loads(row[2]),
+            state=_loads(row[2]),
             created_at=row[3],
         )
 
@@ -312,19 +666,83 @@ class EventStore:
     # Aggregate reconstruction
     # ------------------------------------------------------------------
 
-    def reconstruct(self, aggregate_id: str, aggregate_type: str) -> Aggregate:
-        """Reconstruct an aggregate from snapshot + events."""
-        snap = self.load_snapshot(aggregate_id)
-        from_version = 0
-        agg = Aggregate(id=aggregate_id, type=aggregate_type)
-        if snap:
-            agg.version = snap.version
-            agg.state = deepcopy(snap.state)
-            from_version = snap.version
-
-        events = self.load(aggregate_id, from_version=from_version)
-        for evt in events:
-            agg.apply(evt)
+    def _reads_committed(self) -> bool:
+        """Whether read_conn on this thread sees only committed events.
+
+        A fold that may include uncommitted events must neither come from
+        nor go into the shared aggregate cache.
+        """
+        owner = self._tx_owner
+        return owner is None or (not self._private and owner != threading.get_ident())
+
+    def reconstruct(
+        self,
+        aggregate_id: str,
+        aggregate_type: str,
+        aggregate_cls: Type[Aggregate] = Aggregate,
+    ) -> Aggregate:
+        """Reconstruct an aggregate from cache or snapshot, plus newer events.
+
+        The cache holds each fold's state encoded as JSON, so every call
+        decodes a fresh state and mutating the result never leaks into
+        later calls.
+        """
+        key = (aggregate_id, aggregate_type)
+        default_apply = aggregate_cls.apply is Aggregate.apply
+        if not default_apply:
+            self._custom_apply_types.add(aggregate_type)
+        # Only plain Aggregate folds are cached: subclasses may carry fields
+        # the cached (version, state) pair cannot restore.
+        use_cache = self.cache_size > 0 and aggregate_cls is Aggregate and self._reads_committed()
+        agg = aggregate_cls(id=aggregate_id, type=aggregate_type)
+        cached = None
+        if use_cache:
+            with self._cache_lock:
+                cached = self._aggregate_cache.get(key)
+                generation = self._cache_generation
+        if cached is not None:
+            agg.version, encoded = cached
+            agg.state = _loads(encoded)
+        elif default_apply:
+            # Snapshots are folded with the default merge, so only aggregates
+            # that keep the default apply can start from one.
+            snap = self.load_snapshot(aggregate_id)
+            if snap:
+                # Snapshot state is freshly decoded, so it needs no copy.
+                agg.version = snap.version
+                agg.state = snap.state
+
+        if default_apply:
+            # Default apply is a plain merge: fold payloads without building Events.
+            start = agg.version
+            state = agg.state
+            for version, payload in self.read_conn.execute(
+                self._SQL_LOAD_PAYLOADS, (aggregate_id, agg.version)
+            ):
+                state.update(_loads(payload))
+                agg.version = version
+        else:
+            for evt in self.load(aggregate_id, from_version=agg.version):
+                agg.apply(evt)
+
+        if not use_cache:
+            return agg
+        if cached is None or agg.version != start:
+            try:
+                encoded = _dumps(agg.state)
+            except (TypeError, ValueError):
+                return agg
+        with self._cache_lock:
+            # Re-check: a transaction may have started, or rolled back and
+            # cleared the cache, while this fold was being built.
+            if not self._reads_committed() or generation != self._cache_generation:
+                return agg
+            current = self._aggregate_cache.get(key)
+            if current is None or current[0] <= agg.version:
+                self._aggregate_cache[key] = (agg.version, encoded)
+            self._aggregate_cache.move_to_end(key)
+            if len(self._aggregate_cache) > self.cache_size:
+                self._aggregate_cache.popitem(last=False)
         return agg
 
 
@@ -333,44 +751,53 @@ class EventStore:
 # ---------------------------------------------------------------------------
 
 class CommandBus:
-    def __init__(self, event_store: EventStore):
+    _SQL_RECORD = (
+        "INSERT INTO command_log (id, type, payload, status, issued_at, handled_at) "
+        "VALUES (?,?,?,?,?,?) "
+        "ON CONFLICT(id) DO UPDATE SET status=excluded.status, handled_at=excluded.handled_at"
+    )
+
+    def __init__(self, event_store: EventStore, durable: bool = False):
         self.event_store = event_store
+        self.durable = durable
         self._handlers: Dict[str, Callable] = {}
 
     def register(self, cmd_type: str, handler: Callable):
         self._handlers[cmd_type] = handler
         logger.debug("Registered handler for command: %s", cmd_type)
 
-    def dispatch(self, cmd_type: str, payload: Dict, issued_by: Optional[str] = None) -> Dict:
-        cmd = Command(type=cmd_type, payload=payload, issued_by=issued_by)
+    def _record(self, cmd: Command, status: str, handled_at: Optional[str] = None):
         self.event_store.conn.execute(
-            "INSERT INTO command_log (id, type, payload, status, issued_at) VALUES (?,?,?,?,?)",
-            (cmd.id, cmd.type, json.dumps(cmd.payload), "pending", cmd.issued_at),
+            self._SQL_RECORD,
+            (cmd.id, cmd.type, _dumps(cmd.payload), status, cmd.issued_at, handled_at),
         )
-        self.event_store.conn.commit()
 
+    def dispatch(self, cmd_type: str, payload: Dict, issued_by: Optional[str] = None) -> Dict:
+        """Run a command's handler and log the outcome in ``command_log``.
+
+        The handler's writes and the log row are committed together, so a
+        failing handler leaves no events behind.  With ``durable=True`` a
+        ``pending`` row is committed first so a crash mid-handler is visible.
+        """
+        cmd = Command(type=cmd_type, payload=payload, issued_by=issued_by)
         handler = self._handlers.get(cmd_type)
         if not handler:
-            self.event_store.conn.execute(
-                "UPDATE command_log SET status=? WHERE id=?", ("no_handler", cmd.id)
-            )
-            self.event_store.conn.commit()
+            with self.event_store.transaction():
+                self._record(cmd, "no_handler")
             return {"status": "error", "message": f"No handler for command '{cmd_type}'"}
 
+        if self.durable:
+            with self.event_store.transaction():
+                self._record(cmd, "pending")
         try:
-            result = handler(cmd, self.event_store)
-            self.event_store.conn.execute(
-                "UPDATE command_log SET status=?, handled_at=? WHERE id=?",
-                ("ok", datetime.utcnow().isoformat(), cmd.id),
-            )
-            self.event_store.conn.commit()
-            return {"status": "ok", "result": result}
+            with self.event_store.transaction():
+                result = handler(cmd, self.event_store)
+                self._record(cmd, "ok", datetime.utcnow().isoformat())
         except Exception as exc:
-            self.event_store.conn.execute(
-                "UPDATE command_log SET status=? WHERE id=?", (f"error:{exc}", cmd.id)
-            )
-            self.event_store.conn.commit()
+            with self.event_store.transaction():
+                self._record(cmd, f"error:{exc}")
             return {"status": "error", "message": str(exc)}
+        return {"status": "ok", "result": result}
 
 
 # ---------------------------------------------------------------------------
@@ -378,31 +805,78 @@ class CommandBus:
 # ---------------------------------------------------------------------------
 
 class ProjectionManager:
+    _SQL_LOAD = "SELECT last_position, state FROM projections WHERE name=?"
+    _SQL_INSERT = "INSERT INTO projections (name, last_position, state) VALUES (?,?,?)"
+    _SQL_SAVE = "INSERT OR REPLACE INTO projections (name, last_position, state) VALUES (?,?,?)"
+
     def __init__(self, event_store: EventStore):
         self.event_store = event_store
         self._projections: Dict[str, Projection] = {}
 
     def register(self, projection: Projection):
         self._projections[projection.name] = projection
-        row = self.event_store.conn.execute(
-            "SELECT last_position, state FROM projections WHERE name=?", (projection.name,)
-        ).fetchone()
+        row = self.event_store.read_conn.execute(self._SQL_LOAD, (projection.name,)).fetchone()
         if row:
             projection.last_position = row[0]
-            projection.state = json.loads(row[1])
+            projection.state = _loads(row[1])
         else:
+            with self.event_store.transaction():
+                self.event_store.conn.execute(self._SQL_INSERT, (projection.name, 0, "{}"))
+
+    def _save_projection(self, projection: Projection):
+        with self.event_store.transaction():
             self.event_store.conn.execute(
-                "INSERT INTO projections (name, last_position, state) VALUES (?,?,?)",
-                (projection.name, 0, "{}"),
+                self._SQL_SAVE,
+                (projection.name, projection.last_position, _dumps(projection.state)),
             )
-            self.event_store.conn.commit()
 
-    def _save_projection(self, projection: Projection):
-        self.event_store.conn.execute(
-            "INSERT OR REPLACE INTO projections (name, last_position, state) VALUES (?,?,?)",
-            (projection.name, projection.last_position, json.dumps(projection.state)),
-        )
-        self.event_store.conn.commit()
+    def _replay(self, projections: List[Projection]) -> Dict[str, int]:
+        """Feed each projection the events after its own last_position, in one scan."""
+        counts = {proj.name: 0 for proj in projections}
+        if not projections:
+            return counts
+        start = min(proj.last_position for proj in projections)
+        if any(proj.handlers for proj in projections):
+            for position, evt in self.event_store.iter_positioned(after_position=start):
+                for proj in projections:
+                    if proj.last_position < position:
+                        proj.handle(evt)
+                        proj.last_position = position
+                        counts[proj.name] += 1
+        elif len(projections) == 1:
+            counts[projections[0].name] = self._replay_rows(projections[0])
+        else:
+            rows = self.event_store.iter_projection_rows(after_position=start)
+            for event_type, aggregate_id, payload, position in rows:
+                for proj in projections:
+                    if proj.last_position < position:
+                        proj.handle_row(event_type, aggregate_id, payload)
+                        proj.last_position = position
+                        counts[proj.name] += 1
+        return counts
+
+    def _replay_rows(self, proj: Projection) -> int:
+        """Fused decode-and-dispatch loop for a single row-handler projection.
+
+        Equivalent to calling ``proj.handle_row`` per row, with lookups hoisted
+        out of the loop and no per-event call frame besides the handler.
+        """
+        handlers = proj.row_handlers
+        state = proj.state
+        loads = _loads
+        count = 0
+        position = proj.last_position
+        rows = self.event_store.iter_projection_rows(after_position=position)
+        for event_type, aggregate_id, payload, position in rows:
+            count += 1
+            handler = handlers.get(event_type)
+            if handler is not None:
+                try:
+                    handler(state, event_type, aggregate_id, loads(payload))
+                except Exception as exc:
+                    logger.error("Projection %s handler error: %s", proj.name, exc)
+        proj.last_position = position
+        return count
 
     def rebuild_projection(self, name: str) -> int:
         """Rebuild a projection from all events."""
@@ -411,12 +885,7 @@ class ProjectionManager:
             raise ValueError(f"Projection '{name}' not registered")
         proj.state = {}
         proj.last_position = 0
-        events = self.event_store.load_all_events()
-        count = 0
-        for evt in events:
-            proj.handle(evt)
-            count += 1
-        proj.last_position = self.event_store.get_position()
+        count = self._replay([proj])[name]
         self._save_projection(proj)
         logger.info("Rebuilt projection '%s': processed %d events", name, count)
         return count
@@ -426,13 +895,8 @@ class ProjectionManager:
         proj = self._projections.get(name)
         if not proj:
             raise ValueError(f"Projection '{name}' not registered")
-        events = self.event_store.load_all_events(after_position=proj.last_position)
-        count = 0
-        for evt in events:
-            proj.handle(evt)
-            count += 1
+        count = self._replay([proj])[name]
         if count:
-            proj.last_position = self.event_store.get_position()
             self._save_projection(proj)
         return count
 
@@ -446,7 +910,14 @@ class ProjectionManager:
         return proj.state.get(key)
 
     def advance_all(self) -> Dict[str, int]:
-        return {name: self.advance(name) for name in self._projections}
+        """Advance every projection from one shared scan and save them in one commit."""
+        projections = list(self._projections.values())
+        counts = self._replay(projections)
+        with self.event_store.transaction():
+            for proj in projections:
+                if counts[proj.name]:
+                    self._save_projection(proj)
+        return counts
 
 
 # ---------------------------------------------------------------------------
@@ -454,10 +925,16 @@ class ProjectionManager:
 # ---------------------------------------------------------------------------
 
 class EventSourcingSystem:
-    def __init__(self, db_path: str = ":memory:"):
-        self.store = EventStore(db_path)
+    def __init__(
+        self,
+        db_path: str = ":memory:",
+        pragmas: Optional[Dict[str, Any]] = None,
+        snapshot_every: int = 0,
+    ):
+        self.store = EventStore(db_path, pragmas=pragmas, snapshot_every=snapshot_every)
         self.command_bus = CommandBus(self.store)
         self.projections = ProjectionManager(self.store)
+        self._stats_cache: Optional[Tuple[int, Dict]] = None
 
     def dispatch_command(self, cmd_type: str, payload: Dict, issued_by: Optional[str] = None) -> Dict:
         return self.command_bus.dispatch(cmd_type, payload, issued_by)
@@ -469,16 +946,20 @@ class EventSourcingSystem:
         return self.projections.query_projection(name, key)
 
     def get_aggregate_history(self, aggregate_id: str) -> List[Dict]:
-        events = self.store.load(aggregate_id)
-        return [e.to_dict() for e in events]
+        return self.store.load_dicts(aggregate_id)
 
     def statistics(self) -> Dict:
-        total = self.store.conn.execute("SELECT COUNT(*) FROM events").fetchone()[0]
-        types = self.store.conn.execute(
-            "SELECT event_type, COUNT(*) FROM events GROUP BY event_type"
-        ).fetchall()
-        return {
-            "total_events": total,
-            "by_type": {r[0]: r[1] for r in types},
-            "latest_position": self.store.get_position(),
-        }
+        """Return event counts; cached until the stored position moves."""
+        position = self.store.stored_position()
+        if self._stats_cache and self._stats_cache[0] == position:
+            stats = self._stats_cache[1]
+        else:
+            types = self.store.read_conn.execute(self.store._SQL_COUNT_BY_TYPE).fetchall()
+            stats = {
+                "total_events": sum(r[1] for r in types),
+                "by_type": {r[0]: r[1] for r in types},
+                "latest_position": position,
+            }
+            if not self.store.conn.in_transaction:
+                self._stats_cache = (position, stats)
+        return {**stats, "by_type": dict(stats["by_type"])}
@@ -1,7 +1,14 @@
 """Tests for BlackRoad Event Sourcing"""
+import gc
+import math
+import sqlite3
+import threading
+from dataclasses import dataclass
+from datetime import datetime
+
 import pytest
 from event_sourcing import (
-    Event, Aggregate, Projection, Snapshot, Command,
+    HAS_JSONB, HAS_ORJSON, Event, Aggregate, Projection, Snapshot, Command,
     EventStore, CommandBus, ProjectionManager, EventSourcingSystem,
 )
 
@@ -40,6 +47,28 @@ class TestEvent:
         assert d["aggregate_id"] == "agg-1"
         assert "payload" in d
 
+    def test_event_ids_unique_and_ordered(self):
+        ids = [make_event().id for _ in range(100)]
+        assert len(set(ids)) == 100
+        assert all(len(i) == 32 for i in ids)
+        assert [i[:12] for i in ids] == sorted(i[:12] for i in ids)
+
+    def test_event_has_slots(self):
+        evt = make_event()
+        assert not hasattr(evt, "__dict__")
+        with pytest.raises(AttributeError):
+            evt.extra = 1
+
+    def test_event_explicit_timestamp(self):
+        evt = Event.create("a", "Order", "Created", {}, 1, at="2025-01-01T00:00:00")
+        assert evt.timestamp == "2025-01-01T00:00:00"
+        assert evt.metadata == {}
+
+    def test_timestamp_keyword_stays_metadata(self):
+        evt = Event.create("a", "Order", "Created", {}, 1, timestamp="external")
+        assert evt.metadata == {"timestamp": "external"}
+        assert evt.timestamp != "external"
+
     def test_event_caused_by(self):
         evt = Event.create("a", "Order", "Shipped", {}, 2, caused_by="cmd-123")
         assert evt.caused_by == "cmd-123"
@@ -59,6 +88,13 @@ class TestAggregate:
         assert evt.version == 1
         assert agg.version == 1
 
+    def test_aggregate_raise_events_share_timestamp(self):
+        agg = Aggregate(id="a1", type="Order")
+        events = agg.raise_events([("Created", {"status": "new"}), ("Paid", {"status": "paid"})])
+        assert [e.version for e in events] == [1, 2]
+        assert events[0].timestamp == events[1].timestamp
+        assert agg.state["status"] == "paid"
+
 
 class TestEventStore:
     def test_append_and_load(self, store):
@@ -68,6 +104,91 @@ class TestEventStore:
         assert len(events) == 1
         assert events[0].event_type == "Created"
 
+    def test_append_batch_positions(self, store):
+        store.append("other", [make_event("other", version=1)])
+        positions = store.append("agg-1", [make_event("agg-1", version=i) for i in range(1, 4)])
+        assert positions == [2, 3, 4]
+        assert [e.version for e in store.load("agg-1")] == [1, 2, 3]
+
+    def test_append_batch_is_atomic(self, store):
+        evt = make_event("agg-1", version=1)
+        with pytest.raises(Exception):
+            store.append("agg-1", [make_event("agg-1", version=1), evt, evt])
+        assert store.load("agg-1") == []
+
+    def test_payload_roundtrip(self, store):
+        payload = {"total": 12.5, "items": [{"sku": "a", "qty": 2}], "note": "ünïcode", "paid": None}
+        store.append("agg-1", [make_event("agg-1", payload=payload)])
+        assert store.load("agg-1")[0].payload == payload
+
+    @pytest.mark.skipif(HAS_ORJSON, reason="orjson stores NaN as null")
+    def test_payload_roundtrip_non_finite_floats(self, store):
+        store.append("agg-1", [make_event("agg-1", payload={"x": float("nan"), "y": float("inf"), "z": None})])
+        payload = store.load("agg-1")[0].payload
+        assert math.isnan(payload["x"])
+        assert payload["y"] == float("inf")
+        assert payload["z"] is None
+
+    @pytest.mark.skipif(not HAS_ORJSON, reason="documented orjson behaviour")
+    def test_orjson_stores_non_finite_floats_as_null(self, store):
+        store.append("agg-1", [make_event("agg-1", payload={"x": float("nan"), "y": float("inf")})])
+        assert store.load("agg-1")[0].payload == {"x": None, "y": None}
+
+    @pytest.mark.skipif(HAS_ORJSON, reason="orjson rejects integers wider than 64 bits")
+    def test_payload_roundtrip_wide_integers(self, store):
+        payload = {"big": 2 ** 70, "neg": -(2 ** 65), "ok": 2 ** 62}
+        store.append("agg-1", [make_event("agg-1", payload=payload)])
+        assert store.load("agg-1")[0].payload == payload
+
+    @pytest.mark.skipif(not HAS_ORJSON, reason="documented orjson behaviour")
+    def test_orjson_rejects_wide_integers(self, store):
+        with pytest.raises(TypeError):
+            store.append("agg-1", [make_event("agg-1", payload={"big": 2 ** 70})])
+        assert store.load("agg-1") == []
+
+    def test_payload_types_match_stdlib_json(self, store):
+        for value in (datetime(2025, 1, 1), Snapshot("a", 1, {})):
+            with pytest.raises(TypeError):
+                store.append("agg-1", [make_event("agg-1", payload={"v": value})])
+
+    def test_payloads_stored_as_text_by_default(self, store):
+        store.append("agg-1", [make_event("agg-1", payload={"status": "new"})])
+        kind = store.conn.execute("SELECT typeof(payload) FROM events").fetchone()[0]
+        assert kind == "text"
+        assert store.jsonb is False
+
+    @pytest.mark.skipif(not HAS_JSONB, reason="SQLite < 3.45 has no JSONB")
+    def test_payload_stored_as_jsonb(self):
+        es = EventStore(":memory:", jsonb=True)
+        es.append("agg-1", [make_event("agg-1", payload={"status": "new"})])
+        kind = es.conn.execute("SELECT typeof(payload) FROM events").fetchone()[0]
+        assert kind == "blob"
+        assert es.load("agg-1")[0].payload == {"status": "new"}
+
+    @pytest.mark.skipif(not HAS_JSONB or HAS_ORJSON, reason="needs JSONB and stdlib json")
+    def test_jsonb_rejects_non_finite_floats(self):
+        es = EventStore(":memory:", jsonb=True)
+        with pytest.raises(ValueError):
+            es.append("agg-1", [make_event("agg-1", payload={"x": float("nan")})])
+        assert es.load("agg-1") == []
+
+    @pytest.mark.skipif(HAS_JSONB, reason="SQLite 3.45+ supports JSONB")
+    def test_jsonb_needs_sqlite_support(self):
+        with pytest.raises(sqlite3.NotSupportedError):
+            EventStore(":memory:", jsonb=True)
+
+    def test_payload_format_recorded_in_database(self, tmp_path):
+        path = str(tmp_path / "events.db")
+        es = EventStore(path)
+        es.append("agg-1", [make_event("agg-1")])
+        es.close()
+        with pytest.raises(ValueError, match="text"):
+            EventStore(path, jsonb=True)
+        reopened = EventStore(path)
+        assert reopened.jsonb is False
+        assert len(reopened.load("agg-1")) == 1
+        reopened.close()
+
     def test_load_from_version(self, store):
         for i in range(1, 4):
             store.append("agg-1", [make_event("agg-1", version=i)])
@@ -82,6 +203,28 @@ class TestEventStore:
         events = store.load_all("Order")
         assert len(events) == 2
 
+    def test_iter_all_events(self, store):
+        store.append("a1", [Event.create("a1", "Order", "Created", {}, 1)])
+        store.append("b1", [Event.create("b1", "User", "Registered", {}, 1)])
+        it = store.iter_all_events()
+        assert next(it).aggregate_id == "a1"
+        assert [e.aggregate_id for e in it] == ["b1"]
+        assert [e.aggregate_id for e in store.iter_all_events(after_position=1)] == ["b1"]
+
+    def test_load_all_needs_no_sort(self, store):
+        plan = store.conn.execute(
+            "EXPLAIN QUERY PLAN " + store._SQL_LOAD_ALL, ("Order", 0)
+        ).fetchall()
+        detail = " ".join(r[-1] for r in plan)
+        assert "idx_type" in detail
+        assert "TEMP B-TREE" not in detail
+
+    def test_aggregate_loads_use_covering_index(self, store):
+        for sql in (store._SQL_LOAD, store._SQL_LOAD_PAYLOADS):
+            plan = store.conn.execute("EXPLAIN QUERY PLAN " + sql, ("agg-1", 0)).fetchall()
+            detail = " ".join(r[-1] for r in plan)
+            assert "COVERING INDEX idx_agg_cover" in detail
+
     def test_snapshot_creation(self, store):
         store.append("agg-1", [
             Event.create("agg-1", "Order", "Created", {"status": "new"}, 1),
@@ -92,6 +235,34 @@ class TestEventStore:
         assert snap.version == 2
         assert snap.state["status"] == "paid"
 
+    def test_snapshot_is_incremental(self, store):
+        store.append("agg-1", [Event.create("agg-1", "Order", "Created", {"status": "new", "total": 5}, 1)])
+        store.create_snapshot("agg-1")
+        store.append("agg-1", [Event.create("agg-1", "Order", "Paid", {"status": "paid"}, 2)])
+        snap = store.create_snapshot("agg-1")
+        assert snap.version == 2
+        assert snap.state == {"status": "paid", "total": 5}
+        assert store.create_snapshot("agg-1").version == 2
+
+    def test_auto_snapshot_every(self):
+        es = EventStore(":memory:", snapshot_every=2)
+        es.append("agg-1", [make_event("agg-1", version=1)])
+        assert es.load_snapshot("agg-1") is None
+        es.append("agg-1", [make_event("agg-1", version=2), make_event("agg-1", version=3)])
+        assert es.load_snapshot("agg-1").version == 3
+
+    def test_auto_snapshot_failure_rolls_back_append(self, monkeypatch):
+        es = EventStore(":memory:", snapshot_every=1)
+
+        def fail(aggregate_id):
+            raise RuntimeError("snapshot failed")
+
+        monkeypatch.setattr(es, "create_snapshot", fail)
+        with pytest.raises(RuntimeError):
+            es.append("agg-1", [make_event("agg-1", version=1)])
+        assert es.load("agg-1") == []
+        assert es.get_position() == 0
+
     def test_load_snapshot(self, store):
         store.append("agg-1", [make_event("agg-1", version=1)])
         store.create_snapshot("agg-1")
@@ -123,11 +294,205 @@ class TestEventStore:
         agg = store.reconstruct("agg-1", "Order")
         assert agg.state["status"] == "shipped"
 
+    def test_file_store_uses_wal(self, tmp_path):
+        es = EventStore(str(tmp_path / "events.db"))
+        mode = es.conn.execute("PRAGMA journal_mode").fetchone()[0]
+        assert mode == "wal"
+        assert es.conn.execute("PRAGMA synchronous").fetchone()[0] == 1
+
+    def test_pragma_override(self, tmp_path):
+        es = EventStore(str(tmp_path / "events.db"), pragmas={"journal_mode": None})
+        mode = es.conn.execute("PRAGMA journal_mode").fetchone()[0]
+        assert mode == "delete"
+
+    def test_reconstruct_uses_cache(self, store):
+        store.append("agg-1", [Event.create("agg-1", "Order", "Created", {"items": ["a"]}, 1)])
+        first = store.reconstruct("agg-1", "Order")
+        first.state["status"] = "mutated"
+        store.append("agg-1", [Event.create("agg-1", "Order", "Paid", {"status": "paid"}, 2)])
+        second = store.reconstruct("agg-1", "Order")
+        assert second.version == 2
+        assert second.state == {"items": ["a"], "status": "paid"}
+
+    def test_reconstruct_nested_mutation_does_not_leak(self, store):
+        store.append("agg-1", [Event.create("agg-1", "Order", "Created", {"items": ["a"]}, 1)])
+        agg = store.reconstruct("agg-1", "Order")
+        agg.state["items"].append("b")
+        assert store.reconstruct("agg-1", "Order").state["items"] == ["a"]
+
+    def test_transaction_rolls_back_nested_writes(self, store):
+        with pytest.raises(RuntimeError):
+            with store.transaction():
+                store.append("agg-1", [make_event("agg-1", version=1)])
+                raise RuntimeError("boom")
+        assert store.load("agg-1") == []
+
+    class Counter(Aggregate):
+        def apply(self, event):
+            self.version = event.version
+            self.state["count"] = self.state.get("count", 0) + event.payload["n"]
+
+    def test_reconstruct_custom_aggregate(self, store):
+        store.append("c1", [
+            Event.create("c1", "Counter", "Added", {"n": 2}, 1),
+            Event.create("c1", "Counter", "Added", {"n": 3}, 2),
+        ])
+        agg = store.reconstruct("c1", "Counter", aggregate_cls=self.Counter)
+        assert isinstance(agg, self.Counter)
+        assert agg.version == 2
+        assert agg.state == {"count": 5}
+        assert store.reconstruct("c1", "Counter").state == {"n": 3}
+
+    def test_reconstruct_custom_aggregate_ignores_snapshot(self):
+        es = EventStore(":memory:", snapshot_every=2)
+        es.append("c1", [
+            Event.create("c1", "Counter", "Added", {"n": 2}, 1),
+            Event.create("c1", "Counter", "Added", {"n": 3}, 2),
+        ])
+        es.append("c1", [Event.create("c1", "Counter", "Added", {"n": 4}, 3)])
+        assert es.load_snapshot("c1") is not None
+        agg = es.reconstruct("c1", "Counter", aggregate_cls=self.Counter)
+        assert agg.version == 3
+        assert agg.state == {"count": 9}
+        assert es.reconstruct("c1", "Counter").state == {"n": 4}
+
+    @dataclass
+    class Account(Aggregate):
+        balance: int = 0
+
+        def apply(self, event):
+            self.version = event.version
+            self.balance += event.payload["amount"]
+
+    def test_reconstruct_keeps_subclass_fields(self):
+        for cache_size in (128, 0):
+            es = EventStore(":memory:", cache_size=cache_size)
+            es.append("a1", [
+                Event.create("a1", "Account", "Deposited", {"amount": 2}, 1),
+                Event.create("a1", "Account", "Deposited", {"amount": 3}, 2),
+            ])
+            for _ in range(2):
+                agg = es.reconstruct("a1", "Account", aggregate_cls=self.Account)
+                assert isinstance(agg, self.Account)
+                assert (agg.version, agg.balance) == (2, 5)
+
+    def test_auto_snapshot_skips_custom_apply_types(self):
+        es = EventStore(":memory:", snapshot_every=1)
+        es.append("c1", [Event.create("c1", "Counter", "Added", {"n": 2}, 1)])
+        es.reconstruct("c1", "Counter", aggregate_cls=self.Counter)
+        es.append("c1", [Event.create("c1", "Counter", "Added", {"n": 3}, 2)])
+        assert es.load_snapshot("c1").version == 1
+
+    def test_file_store_reads_use_per_thread_connections(self, tmp_path):
+        es = EventStore(str(tmp_path / "events.db"))
+        es.append("agg-1", [make_event("agg-1", version=1)])
+        assert es.read_conn is not es.conn
+        with pytest.raises(sqlite3.OperationalError):
+            es.read_conn.execute("DELETE FROM events")
+        conns, counts = [], []
+        def reader():
+            conns.append(es.read_conn)
+            counts.append(len(es.load("agg-1")))
+        threads = [threading.Thread(target=reader) for _ in range(3)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        assert counts == [1, 1, 1]
+        assert len({id(c) for c in conns}) == 3
+        es.close()
+
+    def test_read_connections_released_when_threads_exit(self, tmp_path):
+        es = EventStore(str(tmp_path / "events.db"))
+        es.append("agg-1", [make_event("agg-1", version=1)])
+        for _ in range(50):
+            t = threading.Thread(target=lambda: es.load("agg-1"))
+            t.start()
+            t.join()
+        gc.collect()
+        assert len(es._read_conns) == 0
+        es.close()
+
+    def test_temp_file_store_reads_from_write_connection(self):
+        es = EventStore("")
+        es.append("agg-1", [make_event("agg-1", version=1)])
+        result = []
+        t = threading.Thread(target=lambda: result.append(len(es.load("agg-1"))))
+        t.start()
+        t.join()
+        assert result == [1]
+
+    def test_uncommitted_fold_not_cached_for_other_threads(self, tmp_path):
+        es = EventStore(str(tmp_path / "events.db"))
+        es.append("a", [Event.create("a", "T", "Created", {"status": "new"}, 1)])
+        seen = []
+        with pytest.raises(RuntimeError):
+            with es.transaction():
+                es.append("a", [Event.create("a", "T", "Changed", {"status": "UNCOMMITTED"}, 2)])
+                assert es.reconstruct("a", "T").state["status"] == "UNCOMMITTED"
+                t = threading.Thread(target=lambda: seen.append(es.reconstruct("a", "T").state))
+                t.start()
+                t.join()
+                raise RuntimeError("rollback")
+        assert seen == [{"status": "new"}]
+        assert es.reconstruct("a", "T").state == {"status": "new"}
+        es.close()
+
+    def test_other_threads_use_cache_during_transaction(self, tmp_path):
+        es = EventStore(str(tmp_path / "events.db"))
+        es.append("a", [Event.create("a", "T", "Created", {"status": "new"}, 1)])
+        seen = []
+
+        def read():
+            seen.append(es.reconstruct("a", "T").state)
+            seen.append(len(es._aggregate_cache))
+
+        with es.transaction():
+            es.append("b", [Event.create("b", "T", "Created", {}, 1)])
+            t = threading.Thread(target=read)
+            t.start()
+            t.join()
+        assert seen == [{"status": "new"}, 1]
+        es.close()
+
+    def test_private_store_skips_cache_during_transaction(self, store):
+        store.append("a", [Event.create("a", "T", "Created", {"status": "new"}, 1)])
+        with pytest.raises(RuntimeError):
+            with store.transaction():
+                store.append("a", [Event.create("a", "T", "Changed", {"status": "UNCOMMITTED"}, 2)])
+                t = threading.Thread(target=store.reconstruct, args=("a", "T"))
+                t.start()
+                t.join()
+                assert not store._aggregate_cache
+                raise RuntimeError("rollback")
+        assert store.reconstruct("a", "T").state == {"status": "new"}
+
+    def test_reads_inside_transaction_see_own_writes(self, tmp_path):
+        es = EventStore(str(tmp_path / "events.db"))
+        with es.transaction():
+            es.append("agg-1", [make_event("agg-1", version=1)])
+            assert es.read_conn is es.conn
+            assert len(es.load("agg-1")) == 1
+        es.close()
+
     def test_get_position(self, store):
         assert store.get_position() == 0
         store.append("agg-1", [make_event("agg-1", version=1)])
         assert store.get_position() == 1
 
+    def test_get_position_after_rollback_and_reopen(self, tmp_path):
+        db = str(tmp_path / "events.db")
+        es = EventStore(db)
+        es.append("agg-1", [make_event("agg-1", version=1)])
+        with pytest.raises(RuntimeError):
+            with es.transaction():
+                es.append("agg-1", [make_event("agg-1", version=2)])
+                assert es.get_position() == 2
+                raise RuntimeError("boom")
+        assert es.get_position() == 1
+        es.close()
+        assert EventStore(db).get_position() == 1
+
 
 class TestCommandBus:
     def test_dispatch_with_handler(self, store):
@@ -145,6 +510,39 @@ class TestCommandBus:
         bus = CommandBus(store)
         result = bus.dispatch("UnknownCommand", {})
         assert result["status"] == "error"
+        status = store.conn.execute("SELECT status FROM command_log").fetchone()[0]
+        assert status == "no_handler"
+
+    def test_dispatch_logs_single_row(self, store):
+        bus = CommandBus(store)
+        bus.register("Noop", lambda cmd, es: None)
+        bus.dispatch("Noop", {})
+        rows = store.conn.execute("SELECT status, handled_at FROM command_log").fetchall()
+        assert len(rows) == 1
+        assert rows[0][0] == "ok"
+        assert rows[0][1] is not None
+
+    def test_failed_handler_rolls_back_events(self, store):
+        bus = CommandBus(store)
+        def handler(cmd, es):
+            es.append("o1", [Event.create("o1", "Order", "Created", {}, 1)])
+            raise ValueError("rejected")
+        bus.register("CreateOrder", handler)
+        result = bus.dispatch("CreateOrder", {})
+        assert result == {"status": "error", "message": "rejected"}
+        assert store.load("o1") == []
+        status = store.conn.execute("SELECT status FROM command_log").fetchone()[0]
+        assert status == "error:rejected"
+
+    def test_durable_dispatch_records_pending_first(self, store):
+        bus = CommandBus(store, durable=True)
+        seen = []
+        def handler(cmd, es):
+            seen.append(es.conn.execute("SELECT status FROM command_log").fetchone()[0])
+        bus.register("Noop", handler)
+        bus.dispatch("Noop", {})
+        assert seen == ["pending"]
+        assert store.conn.execute("SELECT status FROM command_log").fetchone()[0] == "ok"
 
 
 class TestProjection:
@@ -173,6 +571,63 @@ class TestProjection:
         assert count == 2
         assert "o1" in system.query_projection("order_summary")
 
+    def test_advance_all_shared_scan(self, system):
+        a = Projection("a")
+        a.handlers["Created"] = lambda state, evt: state.update({evt.aggregate_id: True})
+        b = Projection("b")
+        b.handlers["Created"] = lambda state, evt: state.update({evt.aggregate_id: True})
+        system.projections.register(a)
+        system.store.append("o1", [Event.create("o1", "Order", "Created", {}, 1)])
+        system.projections.advance("a")
+        system.projections.register(b)
+        system.store.append("o2", [Event.create("o2", "Order", "Created", {}, 1)])
+        assert system.projections.advance_all() == {"a": 1, "b": 2}
+        assert set(system.query_projection("a")) == {"o1", "o2"}
+        assert set(system.query_projection("b")) == {"o1", "o2"}
+        assert system.projections.advance_all() == {"a": 0, "b": 0}
+
+    def test_advance_all_persists_positions(self, tmp_path):
+        db = str(tmp_path / "events.db")
+        system = EventSourcingSystem(db)
+        system.projections.register(Projection("a"))
+        system.projections.register(Projection("b"))
+        system.store.append("o1", [Event.create("o1", "Order", "Created", {}, 1)])
+        system.projections.advance_all()
+        reopened = EventSourcingSystem(db)
+        proj = Projection("b")
+        reopened.projections.register(proj)
+        assert proj.last_position == 1
+
+    def test_row_handler_projection(self, system):
+        proj = Projection("totals")
+        def on_created(state, event_type, aggregate_id, payload):
+            state[aggregate_id] = payload["total"]
+        proj.row_handlers["OrderCreated"] = on_created
+        system.projections.register(proj)
+        system.store.append("o1", [Event.create("o1", "Order", "OrderCreated", {"total": 10}, 1)])
+        system.store.append("o1", [Event.create("o1", "Order", "Ignored", {}, 2)])
+        assert system.rebuild_projection("totals") == 2
+        assert system.query_projection("totals") == {"o1": 10}
+        assert proj.last_position == 2
+
+    def test_row_handler_errors_do_not_stop_replay(self, system):
+        proj = Projection("p")
+        def on_set(state, event_type, aggregate_id, payload):
+            state[aggregate_id] = 1 / payload["d"]
+        proj.row_handlers["Set"] = on_set
+        system.projections.register(proj)
+        system.store.append("a", [Event.create("a", "T", "Set", {"d": 0}, 1)])
+        system.store.append("b", [Event.create("b", "T", "Set", {"d": 2}, 1)])
+        assert system.projections.advance("p") == 2
+        assert system.query_projection("p") == {"b": 0.5}
+        assert proj.last_position == 2
+
+    def test_row_handler_via_event(self):
+        proj = Projection("p")
+        proj.row_handlers["Created"] = lambda state, et, agg, payload: state.update(payload)
+        assert proj.handle(make_event(payload={"status": "new"}))
+        assert proj.state == {"status": "new"}
+
     def test_query_projection_key(self, system):
         proj = Projection("kv")
         proj.handlers["Set"] = lambda state, evt: state.update({evt.payload["k"]: evt.payload["v"]})
@@ -192,6 +647,27 @@ class TestSystem:
         assert stats["total_events"] == 2
         assert "Created" in stats["by_type"]
 
+    def test_statistics_refresh_after_append(self, system):
+        assert system.statistics() == {"total_events": 0, "by_type": {}, "latest_position": 0}
+        system.store.append("a1", [Event.create("a1", "Order", "Created", {}, 1)])
+        system.statistics()["by_type"]["Created"] = 99
+        stats = system.statistics()
+        assert stats["by_type"] == {"Created": 1}
+        system.store.append("a1", [Event.create("a1", "Order", "Updated", {}, 2)])
+        stats = system.statistics()
+        assert stats["total_events"] == 2
+        assert stats["latest_position"] == 2
+
+    def test_statistics_see_other_writers(self, tmp_path):
+        db = str(tmp_path / "events.db")
+        system = EventSourcingSystem(db)
+        assert system.statistics()["total_events"] == 0
+        other = EventStore(db)
+        other.append("a1", [Event.create("a1", "Order", "Created", {}, 1)])
+        stats = system.statistics()
+        assert stats["total_events"] == 1
+        assert stats["latest_position"] == 1
+
     def test_aggregate_history(self, system):
         system.store.append("a1", [
             Event.create("a1", "Order", "Created", {"status": "new"}, 1),
@@ -199,3 +675,4 @@ class TestSystem:
         history = system.get_aggregate_history("a1")
         assert len(history) == 1
         assert history[0]["event_type"] == "Created"
+        assert history == [e.to_dict() for e in system.store.load("a1")]